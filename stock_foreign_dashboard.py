@@ -14,19 +14,47 @@ import requests
 import urllib3
 import ssl
 import re
+import functools
+import math
+import dataclasses
 import os
 import webbrowser
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
+from urllib.parse import urlsplit
+import lxml.etree
+import lxml.html
+import orjson
 from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ============================================================
+# 連線池 Adapter: keep-alive + 暫時性錯誤重試 (富邦、TWSE 共用)
+# ============================================================
+class PooledAdapter(HTTPAdapter):
+    """調整過連線池大小與重試策略的 HTTPAdapter"""
+    def __init__(self, **kwargs):
+        # keep-alive 連線池: 同 host 重用連線，省去每次請求的 TLS handshake
+        kwargs.setdefault("pool_connections", 4)
+        kwargs.setdefault("pool_maxsize", 8)
+        # 暫時性錯誤 (502/503/504、連線中斷) 自動重試，間隔 0.5s 起指數退避；
+        # 重試用完仍是 5xx 時回傳最後的回應 (不拋 RetryError)，交由呼叫端當作無資料
+        kwargs.setdefault("max_retries", Retry(
+            total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504],
+            raise_on_status=False,
+        ))
+        super().__init__(**kwargs)
+
 
 # ============================================================
 # SSL 修復: 富邦網站憑證缺少 Subject Key Identifier，
 # Python 3.14 預設會拒絕。以下建立自訂 SSL adapter 來處理。
 # 注意: 僅針對富邦網站使用，TWSE 仍使用預設安全驗證。
 # ============================================================
-class FubonSSLAdapter(HTTPAdapter):
+class FubonSSLAdapter(PooledAdapter):
     """自訂 SSL Adapter，放寬對富邦網站的憑證驗證"""
     def init_poolmanager(self, *args, **kwargs):
         ctx = ssl.create_default_context()
@@ -35,6 +63,20 @@ class FubonSSLAdapter(HTTPAdapter):
         kwargs["ssl_context"] = ctx
         return super().init_poolmanager(*args, **kwargs)
 
+
+# ============================================================
+# TWSE 憑證同樣缺少 Subject Key Identifier。Python 3.13+ 預設開啟
+# VERIFY_X509_STRICT 會因此拒絕；這裡只關掉該嚴格檢查，
+# 仍保留 CA 鏈驗證與 hostname 比對 (CERT_REQUIRED + check_hostname)。
+# ============================================================
+class TWSESSLAdapter(PooledAdapter):
+    """TWSE 用 SSL Adapter: 完整驗證憑證，但不套用 X.509 嚴格模式"""
+    def init_poolmanager(self, *args, **kwargs):
+        ctx = ssl.create_default_context()
+        ctx.verify_flags &= ~ssl.VERIFY_X509_STRICT
+        kwargs["ssl_context"] = ctx
+        return super().init_poolmanager(*args, **kwargs)
+
 # 關閉 InsecureRequestWarning (僅針對富邦)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -62,19 +104,82 @@ HEADERS = {
     "Accept-Language": "zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7",
 }
 
-# 請求間隔 (秒), 避免被封鎖
+# 同一網站的請求間隔 (秒), 避免被封鎖; 不同網站之間不互相等待
 REQUEST_DELAY = 3
 
 # ============================================================
 # 共用 Session (Python 3.14 SSL 嚴格模式修正)
-# 富邦 & TWSE 的憑證皆缺少 Subject Key Identifier，
-# Python 3.14 預設會拒絕，僅針對這兩個 domain 放寬 SSL。
+# 富邦: 不驗證憑證；TWSE: 驗證憑證但關閉 X.509 嚴格模式
 # ============================================================
 SESSION = requests.Session()
 SESSION.mount("https://fubon-ebrokerdj.fbs.com.tw", FubonSSLAdapter())
-SESSION.mount("https://www.twse.com.tw", FubonSSLAdapter())
+SESSION.mount("https://www.twse.com.tw", TWSESSLAdapter())
 SESSION.headers.update(HEADERS)
 
+# ============================================================
+# 解析用 regex / 轉換表 (模組載入時預先編譯，逐 cell 使用)
+# ============================================================
+_RE_LINK2STK = re.compile(r"Link2Stk\('([^']+)'\)")
+_RE_CODE_PREFIX = re.compile(r"(\d{4,6}[A-Z]?)")
+_RE_CODE_STRIP = re.compile(r"^\d{4,6}[A-Z]?\s*")
+_RE_PAGE_DATE = re.compile(r"日期[：:]\s*(\d{1,2}/\d{1,2})")
+
+# 數字清理: 單次 C 層級掃描刪除逗號、空白、正號
+_NUM_TRANSLATE = str.maketrans("", "", ", +")
+
+# ============================================================
+# 資料結構: 每檔股票一個 Stock (slots，取代每列一個 dict)
+# ============================================================
+@dataclass(slots=True)
+class Stock:
+    """
+    跌幅排行一檔股票 (合併外資資料後同一物件繼續使用)
+
+    10日頁面解析出來時 five_day_* 其實是 10日漲跌，main 合併時會搬到 ten_day_*。
+    外資欄位 (buy/sell/net 為張數，*_shares 為股數) 無資料時為 None。
+    """
+    rank: int
+    code: str
+    name: str
+    close: float
+    change: float
+    change_pct: float
+    volume: float
+    five_day_change: float | None
+    five_day_pct: float | None
+    ten_day_change: float | None = None
+    ten_day_pct: float | None = None
+    buy: int | None = None
+    sell: int | None = None
+    net: int | None = None
+    buy_shares: int | None = None
+    sell_shares: int | None = None
+    net_shares: int | None = None
+
+
+# 每個 host 各自的鎖 + 上次請求時間 (供 throttled_get 使用)
+_HOST_LOCKS = {}
+_HOST_LAST_REQUEST = {}
+_HOST_LOCKS_GUARD = threading.Lock()
+
+
+def throttled_get(url, **kwargs):
+    """
+    SESSION.get 的節流版本: 同一 host 的請求間隔至少 REQUEST_DELAY 秒，
+    不同 host 各自計時，可同時進行。
+    """
+    host = urlsplit(url).hostname
+    with _HOST_LOCKS_GUARD:
+        lock = _HOST_LOCKS.setdefault(host, threading.Lock())
+    with lock:
+        last = _HOST_LAST_REQUEST.get(host)
+        if last is not None:
+            wait = last + REQUEST_DELAY - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        _HOST_LAST_REQUEST[host] = time.monotonic()
+    return SESSION.get(url, **kwargs)
+
 
 # ============================================================
 # 第一步: 抓取富邦跌幅排行
@@ -89,59 +194,69 @@ def fetch_fubon_ranking(url, label=""):
     """
     print(f"   正在抓取 {label}...")
 
-    resp = SESSION.get(url, timeout=30, verify=False)
-    resp.encoding = "big5"
+    resp = throttled_get(url, timeout=30, verify=False)
 
-    soup = BeautifulSoup(resp.text, "html.parser")
+    # 直接用 lxml.html 解析，不經過 BeautifulSoup 的 Tag 包裝。
+    # 頁面實際是 CP950 (Big5 擴充，如「宏碁」的「碁」)；若交給 libxml2 以 Big5
+    # 解碼，遇到擴充字元會直接截斷後面整份文件。改由 Python 以 cp950 +
+    # errors="replace" 先解碼，確保壞字元只影響單一字，不會丟掉後續列。
+    try:
+        tree = lxml.html.fromstring(resp.content.decode("cp950", errors="replace"))
+    except lxml.etree.ParserError:
+        # 空白或截斷的回應: 回傳空清單，交由 main 顯示無法取得資料
+        print(f"   ⚠ {label} 回應內容為空，無法解析")
+        return [], ""
 
     # 擷取頁面日期 (格式: "日期：02/05" 或 "日期:02/05")
     page_date = ""
-    page_text = soup.get_text()
-    date_match = re.search(r"日期[：:]\s*(\d{1,2}/\d{1,2})", page_text)
+    page_text = tree.text_content()
+    date_match = _RE_PAGE_DATE.search(page_text)
     if date_match:
         page_date = date_match.group(1)  # e.g. "02/05"
-        print(f"   → 頁面資料日期: {page_date}")
+        print(f"   → {label} 頁面資料日期: {page_date}")
 
     def clean_num(text):
-        """清理數字字串，去除逗號和空白"""
-        text = text.strip().replace(",", "").replace(" ", "")
+        """清理數字字串，去除逗號、空白和正號"""
+        text = text.strip().translate(_NUM_TRANSLATE)
         if not text or text == "-":
             return 0.0
-        text = text.replace("+", "")
         try:
             return float(text)
         except ValueError:
             return 0.0
 
     # 收集所有 <td> (依 DOM 順序)
-    all_tds = soup.find_all("td")
+    all_tds = tree.xpath("//td")
+    # 每個 <td> 的文字只擷取一次，掃描時直接查表
+    all_text = [td.text_content().strip() for td in all_tds]
+    n_tds = len(all_tds)
 
     stocks = []
     i = 0
-    while i < len(all_tds):
-        cell_text = all_tds[i].get_text(strip=True)
+    while i < n_tds:
+        cell_text = all_text[i]
 
         # 尋找「名次」: 純數字 1~999
         if cell_text.isdigit() and 1 <= int(cell_text) <= 999:
             rank = int(cell_text)
 
             # 下一個 cell 應該是「股票名稱」(含連結)
-            if i + 1 >= len(all_tds):
+            if i + 1 >= n_tds:
                 break
             name_td = all_tds[i + 1]
-            stock_name_raw = name_td.get_text(strip=True)
+            stock_name_raw = all_text[i + 1]
 
             # 從連結中擷取股票代號
-            link = name_td.find("a")
+            link = name_td.find(".//a")
             stock_code = ""
-            if link and "href" in link.attrs:
-                href = link["href"]
-                match = re.search(r"Link2Stk\('([^']+)'\)", href)
+            if link is not None and link.get("href"):
+                href = link.get("href")
+                match = _RE_LINK2STK.search(href)
                 if match:
                     stock_code = match.group(1)
 
             if not stock_code:
-                match = re.match(r"(\d{4,6}[A-Z]?)", stock_name_raw)
+                match = _RE_CODE_PREFIX.match(stock_name_raw)
                 if match:
                     stock_code = match.group(1)
 
@@ -151,15 +266,15 @@ def fetch_fubon_ranking(url, label=""):
                 continue
 
             # 擷取股票名稱 (去除代號)
-            stock_name = re.sub(r"^\d{4,6}[A-Z]?\s*", "", stock_name_raw).strip()
+            stock_name = _RE_CODE_STRIP.sub("", stock_name_raw).strip()
 
             # 接下來的 cells: 收盤價, 漲跌, [可能的空白cell], 漲跌幅, 成交量, N日漲跌, N日跌幅
             # rank 1-2 有額外空白 cell，所以需要動態判斷
             # 策略: 從 i+2 開始，收集接下來的 cells 直到找到 6 個有效數值欄位
             remaining = []
             j = i + 2
-            while j < len(all_tds) and len(remaining) < 8:
-                val = all_tds[j].get_text(strip=True)
+            while j < n_tds and len(remaining) < 8:
+                val = all_text[j]
                 # 遇到下一個 rank 數字就停
                 if val.isdigit() and 1 <= int(val) <= 999 and len(remaining) >= 6:
                     break
@@ -178,136 +293,156 @@ def fetch_fubon_ranking(url, label=""):
                 nd_change = clean_num(remaining[4])
                 nd_pct = clean_num(remaining[5].replace("%", ""))
 
-                stocks.append({
-                    "rank": rank,
-                    "code": stock_code,
-                    "name": stock_name,
-                    "close": close_price,
-                    "change": change,
-                    "change_pct": change_pct,
-                    "volume": volume,
-                    "five_day_change": nd_change,
-                    "five_day_pct": nd_pct,
-                })
+                stocks.append(Stock(
+                    rank=rank,
+                    code=stock_code,
+                    name=stock_name,
+                    close=close_price,
+                    change=change,
+                    change_pct=change_pct,
+                    volume=volume,
+                    five_day_change=nd_change,
+                    five_day_pct=nd_pct,
+                ))
 
                 i = j  # 跳到已消耗的位置
                 continue
 
         i += 1
 
-    print(f"   → 成功取得 {len(stocks)} 檔股票跌幅資料")
+    print(f"   → {label} 成功取得 {len(stocks)} 檔股票跌幅資料")
     return stocks, page_date
 
 
 # ============================================================
 # 第二步: 抓取 TWSE 外資買賣超資料
 # ============================================================
-def fetch_twse_foreign_data(target_date=None):
-    """
-    抓取 TWSE 外資買賣超彙總表
-    target_date: YYYYMMDD 格式，預設為今天
-    """
-    print("[2/3] 正在抓取 TWSE 外資買賣超資料...")
+def parse_t86_rows(rows):
+    """將 T86 data 列轉為 {股票代號: {買張, 賣張, 淨買賣超}}"""
+    def parse_shares(val):
+        """解析股數 (可能有逗號)"""
+        val = str(val).strip().translate(_NUM_TRANSLATE)
+        try:
+            return int(val)
+        except ValueError:
+            return 0
+
+    foreign_map = {}
+    for row in rows:
+        # T86 欄位: [證券代號, 證券名稱, 外陸資買進股數(不含外資自營商),
+        #           外陸資賣出股數(不含外資自營商), 外陸資買賣超股數(不含外資自營商),
+        #           外資自營商買進股數, 外資自營商賣出股數, 外資自營商買賣超股數,
+        #           投信買進股數, 投信賣出股數, 投信買賣超股數,
+        #           自營商買賣超股數, ...]
+        code = str(row[0]).strip()
+        name = str(row[1]).strip()
+
+        buy_shares = parse_shares(row[2])
+        sell_shares = parse_shares(row[3])
+        net_shares = parse_shares(row[4])
+
+        foreign_map[code] = {
+            "name": name,
+            "buy": buy_shares // 1000,     # 轉為張
+            "sell": sell_shares // 1000,    # 轉為張
+            "net": net_shares // 1000,      # 轉為張
+            "buy_shares": buy_shares,
+            "sell_shares": sell_shares,
+            "net_shares": net_shares,
+        }
+    return foreign_map
 
-    if target_date is None:
-        target_date = datetime.now().strftime("%Y%m%d")
 
+def fetch_t86(date_str, throttle=True):
+    """
+    抓取單一日期的 T86 JSON，回傳 (data 列 或 None, stat)
+    throttle=False 時不經 throttled_get (僅供 fallback 平行探測使用)
+    """
     params = {
-        "date": target_date,
+        "date": date_str,
         "selectType": "ALL",
         "response": "json",
     }
+    get = throttled_get if throttle else SESSION.get
+    resp = get(TWSE_FOREIGN_URL, params=params, timeout=30)
+    # orjson 直接解析 bytes，省去 requests 內部的 str 解碼
+    data = orjson.loads(resp.content)
+    if data.get("stat") == "OK" and data.get("data"):
+        return data["data"], data["stat"]
+    return None, data.get("stat", "未知")
 
-    resp = SESSION.get(
-        TWSE_FOREIGN_URL, params=params, timeout=30, verify=False
-    )
-    data = resp.json()
+
+def fetch_twse_foreign_data(target_date=None):
+    """
+    抓取 TWSE 外資買賣超彙總表
+    target_date: YYYYMMDD 格式，預設為今天
+
+    先只查 target_date (經 throttled_get)。若尚無資料 (盤中或假日)，
+    才把往前 7 天內的平日同時送出，取有資料的最新一天；
+    個別日期查詢失敗視為無資料。
+    """
+    print("   正在抓取 TWSE 外資買賣超...")
+
+    # 預設今天: 直接用 datetime.now()，不必 strftime 後再 strptime 回來
+    if target_date is None:
+        dt = datetime.now()
+        target_date = dt.strftime("%Y%m%d")
+    else:
+        dt = datetime.strptime(target_date, "%Y%m%d")
 
     foreign_map = {}  # {股票代號: {買張, 賣張, 淨買賣超}}
     actual_date = ""  # 實際取得資料的日期
 
-    if data.get("stat") == "OK" and data.get("data"):
-        for row in data["data"]:
-            # T86 欄位: [證券代號, 證券名稱, 外陸資買進股數(不含外資自營商),
-            #           外陸資賣出股數(不含外資自營商), 外陸資買賣超股數(不含外資自營商),
-            #           外資自營商買進股數, 外資自營商賣出股數, 外資自營商買賣超股數,
-            #           投信買進股數, 投信賣出股數, 投信買賣超股數,
-            #           自營商買賣超股數, ...]
-            code = str(row[0]).strip()
-            name = str(row[1]).strip()
-
-            def parse_shares(val):
-                """解析股數 (可能有逗號)"""
-                val = str(val).strip().replace(",", "")
-                try:
-                    return int(val)
-                except ValueError:
-                    return 0
-
-            buy_shares = parse_shares(row[2])
-            sell_shares = parse_shares(row[3])
-            net_shares = parse_shares(row[4])
-
-            foreign_map[code] = {
-                "name": name,
-                "buy": buy_shares // 1000,     # 轉為張
-                "sell": sell_shares // 1000,    # 轉為張
-                "net": net_shares // 1000,      # 轉為張
-                "buy_shares": buy_shares,
-                "sell_shares": sell_shares,
-                "net_shares": net_shares,
-            }
-
-        actual_date = f"{target_date[4:6]}/{target_date[6:8]}"
-        print(f"   → 成功取得 {len(foreign_map)} 檔外資買賣超資料 (日期: {target_date})")
+    found_date = None
+    rows, stat = fetch_t86(target_date)
+    if rows is not None:
+        found_date = target_date
     else:
-        # 如果今天沒資料，往前找最近的交易日
-        stat_msg = data.get("stat", "未知")
-        print(f"   → 日期 {target_date} 無資料 (stat={stat_msg})，嘗試前一交易日...")
+        print(f"   → TWSE 日期 {target_date} 無資料 (stat={stat})，嘗試前一交易日...")
 
-        dt = datetime.strptime(target_date, "%Y%m%d")
-        for i in range(1, 8):  # 最多往前找 7 天
-            prev_dt = dt - timedelta(days=i)
-            prev_date = prev_dt.strftime("%Y%m%d")
-            time.sleep(REQUEST_DELAY)
-
-            params["date"] = prev_date
-            resp2 = SESSION.get(
-                TWSE_FOREIGN_URL, params=params, timeout=30, verify=False
-            )
-            data2 = resp2.json()
-
-            if data2.get("stat") == "OK" and data2.get("data"):
-                for row in data2["data"]:
-                    code = str(row[0]).strip()
-                    name = str(row[1]).strip()
-
-                    def parse_shares2(val):
-                        val = str(val).strip().replace(",", "")
-                        try:
-                            return int(val)
-                        except ValueError:
-                            return 0
-
-                    buy_shares = parse_shares2(row[2])
-                    sell_shares = parse_shares2(row[3])
-                    net_shares = parse_shares2(row[4])
-
-                    foreign_map[code] = {
-                        "name": name,
-                        "buy": buy_shares // 1000,
-                        "sell": sell_shares // 1000,
-                        "net": net_shares // 1000,
-                        "buy_shares": buy_shares,
-                        "sell_shares": sell_shares,
-                        "net_shares": net_shares,
-                    }
-
-                actual_date = f"{prev_date[4:6]}/{prev_date[6:8]}"
-                print(f"   → 成功取得 {len(foreign_map)} 檔外資資料 (日期: {prev_date})")
-                break
-        else:
-            print("   ⚠ 最近 7 天都無外資資料，請確認是否為休市期間")
+        # 候選日期 (一次算好): 往前 7 天內的平日，由新到舊
+        prev_days = (dt - timedelta(days=i) for i in range(1, 8))  # 最多往前找 7 天
+        candidates = [d.strftime("%Y%m%d") for d in prev_days if d.weekday() < 5]
+
+        # results[idx] = data 列 (無資料或失敗為 None)
+        # 當某候選有資料、且比它新的候選都已回應時，即可提前結束
+        results = {}
+        pool = ThreadPoolExecutor(max_workers=4)
+        try:
+            futures = {
+                pool.submit(fetch_t86, d, throttle=False): idx
+                for idx, d in enumerate(candidates)
+            }
+            for fut in as_completed(futures):
+                idx = futures[fut]
+                try:
+                    results[idx], _ = fut.result()
+                except Exception as exc:
+                    # 用不到的舊日期被限流/回傳非 JSON 時，不應中斷整個流程
+                    print(f"   → TWSE 日期 {candidates[idx]} 查詢失敗 ({exc})，視為無資料")
+                    results[idx] = None
+
+                best_idx = None
+                for k in range(len(candidates)):
+                    if k not in results:
+                        break
+                    if results[k] is not None:
+                        best_idx = k
+                        break
+                if best_idx is not None:
+                    found_date = candidates[best_idx]
+                    rows = results[best_idx]
+                    break
+        finally:
+            # 已決定結果就不等待其餘仍在進行的查詢
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    if found_date is not None:
+        foreign_map = parse_t86_rows(rows)
+        actual_date = f"{found_date[4:6]}/{found_date[6:8]}"
+        print(f"   → TWSE 成功取得 {len(foreign_map)} 檔外資買賣超資料 (日期: {found_date})")
+    else:
+        print("   ⚠ TWSE 最近 7 天都無外資資料，請確認是否為休市期間")
 
     return foreign_map, actual_date
 
@@ -315,108 +450,97 @@ def fetch_twse_foreign_data(target_date=None):
 # ============================================================
 # 第三步: 比對 + 產生 HTML Dashboard
 # ============================================================
-def merge_and_classify(stocks, foreign_map):
-    """將跌幅排行與外資買賣超比對合併，分為逢低布局/持續看空"""
-    buying_list = []   # 外資逢低買入
-    selling_list = []  # 外資持續賣出
-    no_data_list = []  # 無外資資料
-
-    for s in stocks:
-        code = s["code"]
-        fdata = foreign_map.get(code)
+def fmt_num(val, is_pct=False):
+    """
+    格式化數字
 
-        if fdata:
-            merged = {**s, **fdata}
-            if fdata["net"] > 0:
-                buying_list.append(merged)
-            else:
-                selling_list.append(merged)
+    同一數值 (0、常見張數/百分比) 在表格中大量重複，以 lru_cache 快取結果。
+    0.0 與 -0.0 相等且 hash 相同，但顯示為 "0.00" / "-0.00"，
+    因此 float 的正負號也放進快取 key。
+    """
+    float_sign = math.copysign(1.0, val) if isinstance(val, float) else None
+    return _fmt_num_cached(val, is_pct, float_sign)
+
+
+@functools.lru_cache(maxsize=4096, typed=True)
+def _fmt_num_cached(val, is_pct, float_sign):
+    """fmt_num 的快取實作; typed=True: 1 與 1.0 的顯示格式不同，不可共用快取"""
+    if val is None:
+        return '<span class="na">N/A</span>'
+    if is_pct:
+        cls = "pos" if val > 0 else "neg" if val < 0 else ""
+        sign = "+" if val > 0 else ""
+        return f'<span class="{cls}">{sign}{val:.2f}%</span>'
+    else:
+        cls = "pos" if val > 0 else "neg" if val < 0 else ""
+        sign = "+" if val > 0 else ""
+        if isinstance(val, float):
+            return f'<span class="{cls}">{sign}{val:,.2f}</span>'
         else:
-            merged = {
-                **s,
-                "buy": None, "sell": None, "net": None,
-                "buy_shares": None, "sell_shares": None, "net_shares": None,
-            }
-            no_data_list.append(merged)
+            return f'<span class="{cls}">{sign}{val:,}</span>'
 
-    # 逢低布局: 按外資淨買張數 由大到小排列
-    buying_list.sort(key=lambda x: x["net"], reverse=True)
-    # 持續看空: 按外資淨賣張數 由小到大排列 (賣最多在最前)
-    selling_list.sort(key=lambda x: x["net"])
 
-    return buying_list, selling_list, no_data_list
+# 表格單列模板 (模組載入時建立一次，make_table_rows 逐列 format)
+_ROW_TMPL = """
+            <tr>
+                <td class="rank-cell">{rank}</td>
+                <td class="code-cell">{code}</td>
+                <td class="name-cell">{name}</td>
+                <td class="num-cell">{close:,.2f}</td>
+                <td class="num-cell">{five_day_change}</td>
+                <td class="num-cell">{five_day_pct}</td>
+                <td class="num-cell">{ten_day_change}</td>
+                <td class="num-cell">{ten_day_pct}</td>
+                <td class="num-cell">{volume}</td>
+                <td class="num-cell">{buy}</td>
+                <td class="num-cell">{sell}</td>
+                <td class="num-cell {net_cls}">{net}</td>
+            </tr>"""
 
 
-def generate_html(buying_list, selling_list, no_data_list,
-                  date_5d="", date_10d="", date_foreign=""):
-    """產生 HTML Dashboard"""
-    print("[3/3] 正在產生 HTML Dashboard...")
+# 表格開頭 / 結尾 (三個區塊共用)
+_TABLE_OPEN = "<table><thead><tr><th>原排名</th><th>代號</th><th>名稱</th><th>收盤價</th><th>5日漲跌</th><th>5日跌幅</th><th>10日漲跌</th><th>10日跌幅</th><th>成交量</th><th>外資買(張)</th><th>外資賣(張)</th><th>外資淨買賣</th></tr></thead><tbody>"
+_TABLE_CLOSE = "</tbody></table>"
 
-    now_str = datetime.now().strftime("%Y/%m/%d %H:%M")
-    total = len(buying_list) + len(selling_list) + len(no_data_list)
 
-    def fmt_num(val, is_pct=False):
-        """格式化數字"""
-        if val is None:
-            return '<span class="na">N/A</span>'
-        if is_pct:
-            cls = "pos" if val > 0 else "neg" if val < 0 else ""
-            sign = "+" if val > 0 else ""
-            return f'<span class="{cls}">{sign}{val:.2f}%</span>'
-        else:
-            cls = "pos" if val > 0 else "neg" if val < 0 else ""
-            sign = "+" if val > 0 else ""
-            if isinstance(val, float):
-                return f'<span class="{cls}">{sign}{val:,.2f}</span>'
-            else:
-                return f'<span class="{cls}">{sign}{val:,}</span>'
+def merge_and_classify(stocks, foreign_map):
+    """將跌幅排行與外資買賣超比對合併，分為逢低布局/持續看空"""
+    matched = []       # 有外資資料: (原順序, 合併後 Stock)
+    no_data_list = []  # 無外資資料
 
-    def make_table_rows(items, group_type):
-        """產生表格行"""
-        rows_html = ""
-        for i, item in enumerate(items, 1):
-            net_val = item["net"]
-            if net_val is not None:
-                net_cls = "buy-highlight" if net_val > 0 else "sell-highlight"
-                net_display = fmt_num(net_val)
-            else:
-                net_cls = ""
-                net_display = '<span class="na">N/A</span>'
+    for s in stocks:
+        fdata = foreign_map.get(s.code)
 
-            buy_display = fmt_num(item["buy"]) if item["buy"] is not None else '<span class="na">N/A</span>'
-            sell_display = fmt_num(item["sell"]) if item["sell"] is not None else '<span class="na">N/A</span>'
+        if fdata:
+            # 外資欄位 (含 TWSE 證券名稱) 覆蓋到副本上
+            matched.append((len(matched), dataclasses.replace(s, **fdata)))
+        else:
+            # 外資欄位預設即為 None
+            no_data_list.append(s)
+
+    # 分類 + 排序只做一次: 依外資淨買賣張數由小到大，
+    # 前段 (net ≤ 0) 即持續看空 (賣最多在最前)，
+    # 後段 (net > 0) 反轉即逢低布局 (買最多在最前)。
+    # 同張數時保持原排行順序: 後段先依原順序倒排，反轉後即為正序。
+    matched.sort(key=lambda p: (p[1].net, -p[0] if p[1].net > 0 else p[0]))
+    split = next(
+        (k for k, (_, m) in enumerate(matched) if m.net > 0), len(matched)
+    )
+    selling_list = [m for _, m in matched[:split]]
+    buying_list = [m for _, m in reversed(matched[split:])]
 
-            rows_html += f"""
-            <tr>
-                <td class="rank-cell">{item['rank']}</td>
-                <td class="code-cell">{item['code']}</td>
-                <td class="name-cell">{item['name']}</td>
-                <td class="num-cell">{item['close']:,.2f}</td>
-                <td class="num-cell">{fmt_num(item['five_day_change'])}</td>
-                <td class="num-cell">{fmt_num(item['five_day_pct'], is_pct=True)}</td>
-                <td class="num-cell">{fmt_num(item.get('ten_day_change'))}</td>
-                <td class="num-cell">{fmt_num(item.get('ten_day_pct'), is_pct=True)}</td>
-                <td class="num-cell">{fmt_num(item['volume'])}</td>
-                <td class="num-cell">{buy_display}</td>
-                <td class="num-cell">{sell_display}</td>
-                <td class="num-cell {net_cls}">{net_display}</td>
-            </tr>"""
-        return rows_html
+    return buying_list, selling_list, no_data_list
 
-    buying_rows = make_table_rows(buying_list, "buy")
-    selling_rows = make_table_rows(selling_list, "sell")
-    nodata_rows = make_table_rows(no_data_list, "nodata")
 
-    html = f"""<!DOCTYPE html>
-<html lang="zh-TW">
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width, initial-scale=1.0">
-<title>跌幅 vs 外資買賣超 Dashboard</title>
-<style>
+# ============================================================
+# HTML 頁面模板 (模組載入時建立一次)
+# 靜態段落 (head + CSS、footer) 為純字串直接寫出；
+# 含數量/日期的段落以 str.format_map 填入，CSS 不經過 format。
+# ============================================================
+_CSS = """\
   @import url('https://fonts.googleapis.com/css2?family=Noto+Sans+TC:wght@300;400;500;700;900&family=JetBrains+Mono:wght@400;600&display=swap');
 
-  :root {{
+  :root {
     --bg-primary: #0a0e17;
     --bg-card: #111827;
     --bg-card-alt: #1a2332;
@@ -431,152 +555,152 @@ def generate_html(buying_list, selling_list, no_data_list,
     --accent-amber: #f59e0b;
     --accent-blue: #3b82f6;
     --header-bg: #0d1320;
-  }}
+  }
 
-  * {{ margin: 0; padding: 0; box-sizing: border-box; }}
+  * { margin: 0; padding: 0; box-sizing: border-box; }
 
-  body {{
+  body {
     font-family: 'Noto Sans TC', sans-serif;
     background: var(--bg-primary);
     color: var(--text-primary);
     min-height: 100vh;
     line-height: 1.6;
-  }}
+  }
 
-  .top-bar {{
+  .top-bar {
     background: linear-gradient(135deg, #0d1117 0%, #161b22 100%);
     border-bottom: 1px solid var(--border);
     padding: 20px 40px;
     display: flex;
     justify-content: space-between;
     align-items: center;
-  }}
+  }
 
-  .top-bar h1 {{
+  .top-bar h1 {
     font-size: 22px;
     font-weight: 700;
     letter-spacing: 1px;
     background: linear-gradient(135deg, #e2e8f0, #94a3b8);
     -webkit-background-clip: text;
     -webkit-text-fill-color: transparent;
-  }}
+  }
 
-  .top-bar .meta {{
+  .top-bar .meta {
     font-family: 'JetBrains Mono', monospace;
     font-size: 13px;
     color: var(--text-secondary);
-  }}
+  }
 
-  .stats-bar {{
+  .stats-bar {
     display: flex;
     gap: 24px;
     padding: 16px 40px;
     background: var(--bg-card);
     border-bottom: 1px solid var(--border);
-  }}
+  }
 
-  .stat-item {{
+  .stat-item {
     display: flex;
     align-items: center;
     gap: 10px;
-  }}
+  }
 
-  .stat-dot {{
+  .stat-dot {
     width: 10px;
     height: 10px;
     border-radius: 50%;
-  }}
+  }
 
-  .stat-dot.green {{ background: var(--accent-green); box-shadow: 0 0 8px var(--accent-green); }}
-  .stat-dot.red {{ background: var(--accent-red); box-shadow: 0 0 8px var(--accent-red); }}
-  .stat-dot.gray {{ background: var(--text-muted); }}
+  .stat-dot.green { background: var(--accent-green); box-shadow: 0 0 8px var(--accent-green); }
+  .stat-dot.red { background: var(--accent-red); box-shadow: 0 0 8px var(--accent-red); }
+  .stat-dot.gray { background: var(--text-muted); }
 
-  .stat-label {{
+  .stat-label {
     font-size: 13px;
     color: var(--text-secondary);
-  }}
+  }
 
-  .stat-value {{
+  .stat-value {
     font-family: 'JetBrains Mono', monospace;
     font-size: 18px;
     font-weight: 700;
-  }}
+  }
 
-  .stat-value.green {{ color: var(--accent-green); }}
-  .stat-value.red {{ color: var(--accent-red); }}
-  .stat-value.gray {{ color: var(--text-secondary); }}
+  .stat-value.green { color: var(--accent-green); }
+  .stat-value.red { color: var(--accent-red); }
+  .stat-value.gray { color: var(--text-secondary); }
 
-  .container {{
+  .container {
     max-width: 1400px;
     margin: 0 auto;
     padding: 24px 24px 60px;
-  }}
+  }
 
-  .section {{
+  .section {
     margin-bottom: 32px;
-  }}
+  }
 
-  .section-header {{
+  .section-header {
     display: flex;
     align-items: center;
     gap: 12px;
     margin-bottom: 14px;
     padding: 0 4px;
-  }}
+  }
 
-  .section-icon {{
+  .section-icon {
     font-size: 20px;
-  }}
+  }
 
-  .section-title {{
+  .section-title {
     font-size: 17px;
     font-weight: 700;
     letter-spacing: 0.5px;
-  }}
+  }
 
-  .section-count {{
+  .section-count {
     font-family: 'JetBrains Mono', monospace;
     font-size: 12px;
     padding: 3px 10px;
     border-radius: 12px;
     font-weight: 600;
-  }}
+  }
 
-  .section.buying .section-title {{ color: var(--accent-green); }}
-  .section.buying .section-count {{
+  .section.buying .section-title { color: var(--accent-green); }
+  .section.buying .section-count {
     background: var(--accent-green-bg);
     color: var(--accent-green);
     border: 1px solid rgba(16, 185, 129, 0.2);
-  }}
+  }
 
-  .section.selling .section-title {{ color: var(--accent-red); }}
-  .section.selling .section-count {{
+  .section.selling .section-title { color: var(--accent-red); }
+  .section.selling .section-count {
     background: var(--accent-red-bg);
     color: var(--accent-red);
     border: 1px solid rgba(239, 68, 68, 0.2);
-  }}
+  }
 
-  .section.nodata .section-title {{ color: var(--text-muted); }}
-  .section.nodata .section-count {{
+  .section.nodata .section-title { color: var(--text-muted); }
+  .section.nodata .section-count {
     background: rgba(74, 85, 104, 0.15);
     color: var(--text-muted);
     border: 1px solid rgba(74, 85, 104, 0.2);
-  }}
+  }
 
-  .table-wrap {{
+  .table-wrap {
     background: var(--bg-card);
     border: 1px solid var(--border);
     border-radius: 10px;
     overflow: hidden;
-  }}
+  }
 
-  table {{
+  table {
     width: 100%;
     border-collapse: collapse;
     font-size: 13.5px;
-  }}
+  }
 
-  thead th {{
+  thead th {
     background: var(--header-bg);
     color: var(--text-secondary);
     font-size: 12px;
@@ -590,96 +714,96 @@ def generate_html(buying_list, selling_list, no_data_list,
     position: sticky;
     top: 0;
     z-index: 2;
-  }}
+  }
 
   thead th:nth-child(1),
   thead th:nth-child(2),
-  thead th:nth-child(3) {{
+  thead th:nth-child(3) {
     text-align: left;
-  }}
+  }
 
-  tbody tr {{
+  tbody tr {
     border-bottom: 1px solid rgba(30, 45, 61, 0.4);
     transition: background 0.15s;
-  }}
+  }
 
-  tbody tr:hover {{
+  tbody tr:hover {
     background: rgba(59, 130, 246, 0.04);
-  }}
+  }
 
-  td {{
+  td {
     padding: 10px 14px;
     font-family: 'JetBrains Mono', monospace;
     font-size: 13px;
-  }}
+  }
 
-  .rank-cell {{
+  .rank-cell {
     text-align: center;
     color: var(--text-muted);
     font-weight: 600;
     width: 44px;
-  }}
+  }
 
-  .code-cell {{
+  .code-cell {
     text-align: left;
     color: var(--accent-blue);
     font-weight: 600;
-  }}
+  }
 
-  .name-cell {{
+  .name-cell {
     text-align: left;
     font-family: 'Noto Sans TC', sans-serif;
     font-weight: 500;
     color: var(--text-primary);
     min-width: 100px;
-  }}
+  }
 
-  .num-cell {{
+  .num-cell {
     text-align: right;
     white-space: nowrap;
-  }}
+  }
 
-  .pos {{ color: var(--accent-red); }}
-  .neg {{ color: var(--accent-green); }}
-  .na {{ color: var(--text-muted); font-style: italic; }}
+  .pos { color: var(--accent-red); }
+  .neg { color: var(--accent-green); }
+  .na { color: var(--text-muted); font-style: italic; }
 
-  .buy-highlight {{
+  .buy-highlight {
     background: var(--accent-green-bg);
-  }}
-  .buy-highlight span {{
+  }
+  .buy-highlight span {
     color: var(--accent-green) !important;
     font-weight: 700;
-  }}
+  }
 
-  .sell-highlight {{
+  .sell-highlight {
     background: var(--accent-red-bg);
-  }}
-  .sell-highlight span {{
+  }
+  .sell-highlight span {
     color: var(--accent-red) !important;
     font-weight: 700;
-  }}
+  }
 
-  .footer {{
+  .footer {
     text-align: center;
     padding: 24px;
     color: var(--text-muted);
     font-size: 12px;
     border-top: 1px solid var(--border);
     margin-top: 40px;
-  }}
+  }
 
-  .empty-msg {{
+  .empty-msg {
     text-align: center;
     padding: 40px;
     color: var(--text-muted);
     font-size: 14px;
-  }}
+  }
 
   /* 台股漲跌顏色: 漲=紅, 跌=綠 (符合台灣習慣) */
   /* 注意: 這裡的 pos/neg class 已對應台灣慣例 */
   /* pos (>0) = 紅色 (漲), neg (<0) = 綠色 (跌) */
 
-  .data-source-bar {{
+  .data-source-bar {
     background: var(--bg-card);
     border-bottom: 1px solid var(--border);
     padding: 12px 40px;
@@ -687,21 +811,21 @@ def generate_html(buying_list, selling_list, no_data_list,
     align-items: center;
     gap: 32px;
     flex-wrap: wrap;
-  }}
+  }
 
-  .source-item {{
+  .source-item {
     display: flex;
     align-items: center;
     gap: 8px;
-  }}
+  }
 
-  .source-label {{
+  .source-label {
     font-size: 12.5px;
     color: var(--text-secondary);
     font-weight: 500;
-  }}
+  }
 
-  .source-date {{
+  .source-date {
     font-family: 'JetBrains Mono', monospace;
     font-size: 13px;
     font-weight: 700;
@@ -709,9 +833,9 @@ def generate_html(buying_list, selling_list, no_data_list,
     background: rgba(59, 130, 246, 0.1);
     padding: 2px 10px;
     border-radius: 4px;
-  }}
+  }
 
-  .date-warning {{
+  .date-warning {
     color: var(--accent-amber);
     font-size: 12.5px;
     font-weight: 600;
@@ -720,12 +844,23 @@ def generate_html(buying_list, selling_list, no_data_list,
     border-radius: 6px;
     border: 1px solid rgba(245, 158, 11, 0.25);
     margin-left: auto;
-  }}
-</style>
+  }
+"""
+
+_HTML_HEAD = """<!DOCTYPE html>
+<html lang="zh-TW">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>跌幅 vs 外資買賣超 Dashboard</title>
+<style>
+""" + _CSS + """</style>
 </head>
 <body>
 
-<div class="top-bar">
+"""
+
+_HTML_SUMMARY_TMPL = """<div class="top-bar">
   <h1>📊 跌幅排行 vs 外資買賣超 Dashboard</h1>
   <div class="meta">
     更新時間: {now_str} ｜ 上市 5日+10日 跌幅合併 共 {total} 檔
@@ -735,17 +870,17 @@ def generate_html(buying_list, selling_list, no_data_list,
 <div class="data-source-bar">
   <div class="source-item">
     <span class="source-label">📈 5日跌幅</span>
-    <span class="source-date">{date_5d if date_5d else "N/A"}</span>
+    <span class="source-date">{date_5d}</span>
   </div>
   <div class="source-item">
     <span class="source-label">📉 10日跌幅</span>
-    <span class="source-date">{date_10d if date_10d else "N/A"}</span>
+    <span class="source-date">{date_10d}</span>
   </div>
   <div class="source-item">
     <span class="source-label">🏦 外資買賣超</span>
-    <span class="source-date">{date_foreign if date_foreign else "N/A"}</span>
+    <span class="source-date">{date_foreign}</span>
   </div>
-  {"" if (date_5d == date_foreign and date_5d) or (not date_5d and not date_foreign) else '<div class="date-warning">⚠ 注意：跌幅資料與外資資料日期不同步，比對結果可能有誤差！</div>'}
+  {date_warning}
 </div>
 
 <div class="stats-bar">
@@ -753,21 +888,21 @@ def generate_html(buying_list, selling_list, no_data_list,
     <div class="stat-dot green"></div>
     <div>
       <div class="stat-label">外資逢低布局</div>
-      <div class="stat-value green">{len(buying_list)}</div>
+      <div class="stat-value green">{buying_count}</div>
     </div>
   </div>
   <div class="stat-item">
     <div class="stat-dot red"></div>
     <div>
       <div class="stat-label">外資持續看空</div>
-      <div class="stat-value red">{len(selling_list)}</div>
+      <div class="stat-value red">{selling_count}</div>
     </div>
   </div>
   <div class="stat-item">
     <div class="stat-dot gray"></div>
     <div>
       <div class="stat-label">無外資資料</div>
-      <div class="stat-value gray">{len(no_data_list)}</div>
+      <div class="stat-value gray">{nodata_count}</div>
     </div>
   </div>
 </div>
@@ -779,10 +914,12 @@ def generate_html(buying_list, selling_list, no_data_list,
     <div class="section-header">
       <span class="section-icon">🟢</span>
       <span class="section-title">外資逢低布局</span>
-      <span class="section-count">{len(buying_list)} 檔</span>
+      <span class="section-count">{buying_count} 檔</span>
     </div>
     <div class="table-wrap">
-      {"<table><thead><tr><th>原排名</th><th>代號</th><th>名稱</th><th>收盤價</th><th>5日漲跌</th><th>5日跌幅</th><th>10日漲跌</th><th>10日跌幅</th><th>成交量</th><th>外資買(張)</th><th>外資賣(張)</th><th>外資淨買賣</th></tr></thead><tbody>" + buying_rows + "</tbody></table>" if buying_list else '<div class="empty-msg">目前無跌幅股票被外資逢低買入</div>'}
+      """
+
+_HTML_SELLING_TMPL = """
     </div>
   </div>
 
@@ -791,26 +928,34 @@ def generate_html(buying_list, selling_list, no_data_list,
     <div class="section-header">
       <span class="section-icon">🔴</span>
       <span class="section-title">外資持續看空</span>
-      <span class="section-count">{len(selling_list)} 檔</span>
+      <span class="section-count">{selling_count} 檔</span>
     </div>
     <div class="table-wrap">
-      {"<table><thead><tr><th>原排名</th><th>代號</th><th>名稱</th><th>收盤價</th><th>5日漲跌</th><th>5日跌幅</th><th>10日漲跌</th><th>10日跌幅</th><th>成交量</th><th>外資買(張)</th><th>外資賣(張)</th><th>外資淨買賣</th></tr></thead><tbody>" + selling_rows + "</tbody></table>" if selling_list else '<div class="empty-msg">目前無跌幅股票被外資持續賣出</div>'}
+      """
+
+_HTML_NODATA_MARK = """
     </div>
   </div>
 
   <!-- ⚪ 無外資資料 -->
-  {"" if not no_data_list else '''
+  """
+
+_HTML_NODATA_OPEN_TMPL = """
   <div class="section nodata">
     <div class="section-header">
       <span class="section-icon">⚪</span>
       <span class="section-title">無外資資料</span>
-      <span class="section-count">''' + str(len(no_data_list)) + ''' 檔</span>
+      <span class="section-count">{nodata_count} 檔</span>
     </div>
     <div class="table-wrap">
-      <table><thead><tr><th>原排名</th><th>代號</th><th>名稱</th><th>收盤價</th><th>5日漲跌</th><th>5日跌幅</th><th>10日漲跌</th><th>10日跌幅</th><th>成交量</th><th>外資買(張)</th><th>外資賣(張)</th><th>外資淨買賣</th></tr></thead><tbody>''' + nodata_rows + '''</tbody></table>
+      """
+
+_HTML_NODATA_CLOSE = """
     </div>
   </div>
-  '''}
+  """
+
+_HTML_FOOTER = """
 
 </div>
 
@@ -822,7 +967,83 @@ def generate_html(buying_list, selling_list, no_data_list,
 </body>
 </html>"""
 
-    return html
+_DATE_WARNING_HTML = '<div class="date-warning">⚠ 注意：跌幅資料與外資資料日期不同步，比對結果可能有誤差！</div>'
+
+
+def generate_html(out, buying_list, selling_list, no_data_list,
+                  date_5d="", date_10d="", date_foreign=""):
+    """產生 HTML Dashboard，逐段寫入已開啟的文字檔 out"""
+    print("[2/2] 正在產生 HTML Dashboard...")
+
+    now_str = datetime.now().strftime("%Y/%m/%d %H:%M")
+    total = len(buying_list) + len(selling_list) + len(no_data_list)
+
+    def write_table(items, empty_html):
+        """逐列寫出表格 (不在記憶體中累積整張表)；無資料時寫出 empty_html"""
+        if not items:
+            out.write(empty_html)
+            return
+        out.write(_TABLE_OPEN)
+        for i, item in enumerate(items, 1):
+            net_val = item.net
+            if net_val is not None:
+                net_cls = "buy-highlight" if net_val > 0 else "sell-highlight"
+                net_display = fmt_num(net_val)
+            else:
+                net_cls = ""
+                net_display = '<span class="na">N/A</span>'
+
+            buy_val = item.buy
+            sell_val = item.sell
+            buy_display = fmt_num(buy_val) if buy_val is not None else '<span class="na">N/A</span>'
+            sell_display = fmt_num(sell_val) if sell_val is not None else '<span class="na">N/A</span>'
+
+            out.write(_ROW_TMPL.format(
+                rank=item.rank,
+                code=item.code,
+                name=item.name,
+                close=item.close,
+                five_day_change=fmt_num(item.five_day_change),
+                five_day_pct=fmt_num(item.five_day_pct, is_pct=True),
+                ten_day_change=fmt_num(item.ten_day_change),
+                ten_day_pct=fmt_num(item.ten_day_pct, is_pct=True),
+                volume=fmt_num(item.volume),
+                buy=buy_display,
+                sell=sell_display,
+                net_cls=net_cls,
+                net=net_display,
+            ))
+        out.write(_TABLE_CLOSE)
+
+    fields = {
+        "now_str": now_str,
+        "total": total,
+        "date_5d": date_5d if date_5d else "N/A",
+        "date_10d": date_10d if date_10d else "N/A",
+        "date_foreign": date_foreign if date_foreign else "N/A",
+        "date_warning": (
+            "" if (date_5d == date_foreign and date_5d) or (not date_5d and not date_foreign)
+            else _DATE_WARNING_HTML
+        ),
+        "buying_count": len(buying_list),
+        "selling_count": len(selling_list),
+        "nodata_count": len(no_data_list),
+    }
+
+    out.write(_HTML_HEAD)
+    out.write(_HTML_SUMMARY_TMPL.format_map(fields))
+    write_table(buying_list, '<div class="empty-msg">目前無跌幅股票被外資逢低買入</div>')
+
+    out.write(_HTML_SELLING_TMPL.format_map(fields))
+    write_table(selling_list, '<div class="empty-msg">目前無跌幅股票被外資持續賣出</div>')
+
+    out.write(_HTML_NODATA_MARK)
+    if no_data_list:
+        out.write(_HTML_NODATA_OPEN_TMPL.format_map(fields))
+        write_table(no_data_list, "")
+        out.write(_HTML_NODATA_CLOSE)
+
+    out.write(_HTML_FOOTER)
 
 
 # ============================================================
@@ -834,80 +1055,68 @@ def main():
     print("=" * 60)
     print()
 
-    # Step 1: 抓富邦跌幅排行 (5日 + 10日)
-    print("[1/3] 正在抓取富邦 e-Broker 跌幅排行...")
-    stocks_5d, date_5d = fetch_fubon_ranking(FUBON_URL_5D, "5日跌幅排行")
+    # Step 1 + 2: 富邦跌幅排行 (5日 + 10日) 與 TWSE 外資買賣超 同時抓取
+    # 富邦兩頁同 host，由 throttled_get 維持間隔；TWSE 不需等待富邦
+    # 三個來源同時進行，各來源的進度行會交錯輸出，因此每行都標明來源
+    print("[1/2] 同時抓取富邦 5日/10日跌幅排行 + TWSE 外資買賣超...")
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        fut_5d = pool.submit(fetch_fubon_ranking, FUBON_URL_5D, "5日跌幅排行")
+        fut_10d = pool.submit(fetch_fubon_ranking, FUBON_URL_10D, "10日跌幅排行")
+        fut_twse = pool.submit(fetch_twse_foreign_data)
+
+        stocks_5d, date_5d = fut_5d.result()
+        stocks_10d, date_10d = fut_10d.result()
+        foreign_map, date_foreign = fut_twse.result()
+
     if not stocks_5d:
         print("❌ 無法取得5日跌幅排行資料，請檢查網路連線或網址是否有效")
         return
 
-    time.sleep(REQUEST_DELAY)
-
-    stocks_10d, date_10d = fetch_fubon_ranking(FUBON_URL_10D, "10日跌幅排行")
-
     # ---- 合併邏輯: 以5日為主，補入10日資料；只在10日的也加入 ----
-    # 建立 5日 map
-    five_day_map = {}
-    for s in stocks_5d:
-        five_day_map[s["code"]] = s
+    # 5日代號集合 (只用於判斷是否已在5日清單)
+    five_day_codes = {s.code for s in stocks_5d}
 
-    # 建立 10日 map
-    ten_day_map = {}
-    for s in stocks_10d:
-        ten_day_map[s["code"]] = {
-            "ten_day_change": s["five_day_change"],  # 10日頁面欄位結構同5日
-            "ten_day_pct": s["five_day_pct"],
-            "ten_day_rank": s["rank"],
-            # 保留完整資料，給「只在10日」的股票用
-            "full": s,
-        }
+    # 10日頁面欄位結構同5日 (five_day_* 其實是 10日漲跌)
+    ten_day_lookup = {
+        s.code: (s.five_day_change, s.five_day_pct) for s in stocks_10d
+    }
 
     # (A) 5日清單: 補入 10日欄位
-    stocks = []
     for s in stocks_5d:
-        td = ten_day_map.get(s["code"], {})
-        s["ten_day_change"] = td.get("ten_day_change")
-        s["ten_day_pct"] = td.get("ten_day_pct")
-        stocks.append(s)
+        s.ten_day_change, s.ten_day_pct = ten_day_lookup.get(s.code, (None, None))
+    stocks = list(stocks_5d)
 
-    # (B) 只在10日、不在5日的股票: 補入（5日欄位填 None）
+    # (B) 只在10日、不在5日的股票: 直接沿用 10日 Stock，搬移欄位後5日欄位填 None
     only_10d_count = 0
-    for code, td in ten_day_map.items():
-        if code not in five_day_map:
-            orig = td["full"]
-            stocks.append({
-                "rank": orig["rank"],
-                "code": orig["code"],
-                "name": orig["name"],
-                "close": orig["close"],
-                "change": orig["change"],
-                "change_pct": orig["change_pct"],
-                "volume": orig["volume"],
-                "five_day_change": None,
-                "five_day_pct": None,
-                "ten_day_change": td["ten_day_change"],
-                "ten_day_pct": td["ten_day_pct"],
-            })
+    for s in stocks_10d:
+        if s.code not in five_day_codes:
+            s.ten_day_change, s.ten_day_pct = s.five_day_change, s.five_day_pct
+            s.five_day_change = None
+            s.five_day_pct = None
+            stocks.append(s)
             only_10d_count += 1
 
     print(f"   → 合併後共 {len(stocks)} 檔 (5日:{len(stocks_5d)}, 僅10日:{only_10d_count})")
 
-    time.sleep(REQUEST_DELAY)
-
-    # Step 2: 抓 TWSE 外資買賣超
-    foreign_map, date_foreign = fetch_twse_foreign_data()
-
     # Step 3: 比對 + 產生 HTML
     buying, selling, nodata = merge_and_classify(stocks, foreign_map)
 
-    html_content = generate_html(buying, selling, nodata,
-                                 date_5d=date_5d, date_10d=date_10d,
-                                 date_foreign=date_foreign)
-
-    # 寫入檔案
+    # 產生 HTML 並直接串流寫入檔案
+    # 先寫入暫存檔 (1 MB 緩衝，整頁一次 flush)，完成後 os.replace 原子替換，
+    # 瀏覽器不會讀到寫到一半的檔案
     output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), OUTPUT_HTML)
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(html_content)
+    tmp_path = output_path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+            generate_html(f, buying, selling, nodata,
+                          date_5d=date_5d, date_10d=date_10d,
+                          date_foreign=date_foreign)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        # 產生失敗 (含 Ctrl+C) 時不留下寫到一半的暫存檔
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
 
     print()
     print(f"✅ Dashboard 已產生: {output_path}")
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# 讓測試可直接 import 根目錄的 stock_foreign_dashboard.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeResponse:
+    """只帶 .content (bytes) 的假 requests 回應"""
+    def __init__(self, content):
+        self.content = content
+
+
+@pytest.fixture
+def fake_response():
+    """回傳 FakeResponse 類別，供測試以假回應取代網路請求"""
+    return FakeResponse
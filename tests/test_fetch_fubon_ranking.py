@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""fetch_fubon_ranking 解析測試 (以假回應取代網路請求)"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+
+import stock_foreign_dashboard as dashboard
+
+
+def make_page(names):
+    """產生與富邦跌幅排行相同格式 (全 <td> 掃描) 的 CP950 頁面"""
+    rows = []
+    for rank, name in enumerate(names, 1):
+        code = name[:4]
+        rows.append(
+            f"<tr><td>{rank}</td>"
+            f"<td><a href=\"javascript:Link2Stk('{code}');\">{name}</a></td>"
+            "<td>100.00</td><td>-1.00</td><td>-1.00%</td><td>1,234</td>"
+            "<td>-5.00</td><td>-4.76%</td></tr>"
+        )
+    html = (
+        '<html><head><meta http-equiv="Content-Type" content="text/html; charset=big5">'
+        "</head><body><table><tr><td>日期：02/05</td></tr>"
+        + "".join(rows)
+        + "</table></body></html>"
+    )
+    return html.encode("cp950")
+
+
+def test_cp950_only_name_does_not_truncate_rows(monkeypatch, fake_response):
+    # 「碁」(0xF9D6) 只存在於 CP950，嚴格 Big5 解碼會在此截斷後續所有列
+    page = make_page(["2330台積電", "2353宏碁", "2317鴻海"])
+    monkeypatch.setattr(dashboard, "throttled_get", lambda *a, **k: fake_response(page))
+
+    stocks, page_date = dashboard.fetch_fubon_ranking("https://example.invalid", "test")
+
+    assert page_date == "02/05"
+    assert [(s.code, s.name) for s in stocks] == [
+        ("2330", "台積電"),
+        ("2353", "宏碁"),
+        ("2317", "鴻海"),
+    ]
+    assert stocks[2].five_day_pct == -4.76
+
+
+def test_empty_response_returns_no_stocks(monkeypatch, fake_response):
+    monkeypatch.setattr(dashboard, "throttled_get", lambda *a, **k: fake_response(b""))
+
+    assert dashboard.fetch_fubon_ranking("https://example.invalid", "test") == ([], "")
+
+
+class AlwaysUnavailableHandler(BaseHTTPRequestHandler):
+    """每次都回 503 的本機伺服器"""
+    def do_GET(self):
+        body = "<html><body>Service Unavailable</body></html>".encode("cp950")
+        self.send_response(503)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_persistent_503_returns_no_stocks(monkeypatch):
+    server = HTTPServer(("127.0.0.1", 0), AlwaysUnavailableHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        session = requests.Session()
+        session.mount(base_url, dashboard.PooledAdapter())
+        monkeypatch.setattr(dashboard, "SESSION", session)
+
+        # 重試用完後應回傳最後的 503 回應，而不是拋出 RetryError
+        assert dashboard.fetch_fubon_ranking(base_url + "/zg.djhtm", "test") == ([], "")
+    finally:
+        server.shutdown()
+        server.server_close()
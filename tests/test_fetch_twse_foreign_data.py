@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""fetch_twse_foreign_data 日期 fallback 測試 (以假回應取代網路請求)"""
+
+import threading
+
+import orjson
+
+import stock_foreign_dashboard as dashboard
+
+ROWS = [["2330", "台積電", "1,500,000", "500,000", "1,000,000"]]
+
+
+def fake_get_factory(fake_response, available, failing=(), calls=None):
+    """available: 有資料的日期；failing: 回傳非 JSON (例如被限流) 的日期"""
+    lock = threading.Lock()
+
+    def fake_get(url, params=None, **kwargs):
+        date = params["date"]
+        with lock:
+            if calls is not None:
+                calls.append(date)
+        if date in failing:
+            return fake_response(b"<html>Too Many Requests</html>")
+        if date in available:
+            return fake_response(orjson.dumps({"stat": "OK", "data": ROWS}))
+        return fake_response(orjson.dumps({"stat": "很抱歉，沒有符合條件的資料!"}))
+
+    return fake_get
+
+
+def test_target_date_with_data_sends_single_request(monkeypatch, fake_response):
+    calls = []
+    fake_get = fake_get_factory(fake_response, {"20261015"}, calls=calls)
+    monkeypatch.setattr(dashboard, "throttled_get", fake_get)
+    monkeypatch.setattr(dashboard.SESSION, "get", fake_get)
+
+    foreign_map, actual_date = dashboard.fetch_twse_foreign_data("20261015")
+
+    assert calls == ["20261015"]
+    assert actual_date == "10/15"
+    assert foreign_map["2330"]["net"] == 1000
+
+
+def test_fallback_picks_newest_weekday_and_ignores_failed_probe(monkeypatch, fake_response):
+    calls = []
+    # 20261019 (一) 無資料；20261016 (五) 查詢失敗；20261015 (四) 有資料
+    fake_get = fake_get_factory(
+        fake_response, {"20261015", "20261014"}, failing={"20261016", "20261013"}, calls=calls,
+    )
+    monkeypatch.setattr(dashboard, "throttled_get", fake_get)
+    monkeypatch.setattr(dashboard.SESSION, "get", fake_get)
+
+    foreign_map, actual_date = dashboard.fetch_twse_foreign_data("20261019")
+
+    assert actual_date == "10/15"
+    assert "2330" in foreign_map
+    # 週六日 (20261017, 20261018) 不送出請求
+    assert "20261017" not in calls and "20261018" not in calls
+
+
+def test_no_data_within_seven_days(monkeypatch, fake_response):
+    fake_get = fake_get_factory(fake_response, set(), failing={"20261014"})
+    monkeypatch.setattr(dashboard, "throttled_get", fake_get)
+    monkeypatch.setattr(dashboard.SESSION, "get", fake_get)
+
+    assert dashboard.fetch_twse_foreign_data("20261015") == ({}, "")
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""fmt_num 快取測試"""
+
+import stock_foreign_dashboard as dashboard
+
+
+def test_int_and_float_are_cached_separately():
+    assert dashboard.fmt_num(1) == '<span class="pos">+1</span>'
+    assert dashboard.fmt_num(1.0) == '<span class="pos">+1.00</span>'
+
+
+def test_signed_zero_is_not_shared_in_cache():
+    # clean_num("-0.00") 回傳 -0.0；不論先算哪一個，顯示都不可被另一個覆蓋
+    assert dashboard.fmt_num(-0.0) == '<span class="">-0.00</span>'
+    assert dashboard.fmt_num(0.0) == '<span class="">0.00</span>'
+    assert dashboard.fmt_num(-0.0) == '<span class="">-0.00</span>'
+    assert dashboard.fmt_num(0.0, is_pct=True) == '<span class="">0.00%</span>'
+    assert dashboard.fmt_num(-0.0, is_pct=True) == '<span class="">-0.00%</span>'